@@ -57,7 +57,7 @@ def main():
     save_dir = _setup_results_dir(Path.cwd() / "models/train_comp_2d", args)
 
     betas = improved_beta_schedule(num_timesteps=num_diff_steps)
-    time_steps = th.tensor([i for i in range(num_diff_steps)])
+    time_steps = th.arange(num_diff_steps)
     diff_sampler = DiffusionSampler(betas, time_steps)
 
     diffm = DiffusionModel(model=diff_model, loss_f=F.mse_loss, noise_scheduler=diff_sampler)
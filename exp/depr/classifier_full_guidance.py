@@ -12,7 +12,7 @@ import torch as th
 from src.guidance.base import GuidanceSampler
 from src.guidance.classifier_full import ClassifierFullGuidance
 from src.model.resnet import load_classifier
-from src.utils.net import Device, get_device
+from src.utils.net import Device, get_device, set_cuda_backend_flags
 from src.diffusion.base import DiffusionSampler
 from src.diffusion.beta_schedules import improved_beta_schedule, linear_beta_schedule, respaced_beta_schedule
 from src.model.unet import load_mnist_diff
@@ -23,11 +23,12 @@ from src.model.guided_diff.classifier import load_guided_classifier
 def main():
     args = parse_args()
     device = get_device(Device.GPU)
+    set_cuda_backend_flags()
     models_dir = Path.cwd() / "models"
     diff_model_path = models_dir / f"{args.diff_model}.pt"
     class_model_path = models_dir / f"{args.class_model}.pt"
     num_samples = args.num_samples
-    classes = th.ones((num_samples,), dtype=th.int64).to(device)
+    classes = th.ones((num_samples,), dtype=th.int64, device=device)
     print("Loading models")
     if "mnist" in args.diff_model:
         channels, image_size = 1, 28
@@ -47,6 +48,10 @@ def main():
         posterior_variance = "learned"
         num_classes = 1000
 
+    if args.compile_model:
+        diff_model = th.compile(diff_model, mode="reduce-overhead", fullgraph=False)
+        classifier = th.compile(classifier, mode="reduce-overhead", fullgraph=False)
+
     betas, time_steps = respaced_beta_schedule(
         original_betas=beta_schedule(num_timesteps=args.num_diff_steps),
         T=args.num_diff_steps,
@@ -88,6 +93,7 @@ def parse_args():
     parser.add_argument("--class_model", type=str, help="Classifier model file (withouth '.pt' extension)")
     parser.add_argument("--class_cond", action="store_true", help="Use classconditional diff. model")
     parser.add_argument("--plot", action="store_true", help="enables plots")
+    parser.add_argument("--compile_model", action="store_true", help="Compile diff. model and classifier")
     return parser.parse_args()
 
 
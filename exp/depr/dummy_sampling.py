@@ -28,7 +28,7 @@ def main():
     T = args.num_diff_steps
     # beta_schedule = partial(_sparse_betas, og_schedule=improved_beta_schedule, og_num_diff_steps=1000)
     betas = improved_beta_schedule(num_timesteps=T)
-    time_steps = th.tensor([i for i in range(T)])
+    time_steps = th.arange(T)
     diff_sampler = DiffusionSampler(betas, time_steps)
 
     samples, _ = diff_sampler.sample(
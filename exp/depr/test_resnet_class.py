@@ -46,7 +46,7 @@ def test_classifier_t():
 
     num_diff_steps = 1000
     betas = improved_beta_schedule(num_timesteps=num_diff_steps)
-    time_steps = th.tensor([i for i in range(num_diff_steps)])
+    time_steps = th.arange(num_diff_steps)
     noise_scheduler = DiffusionSampler(betas, time_steps)
     n_points = 10
     ts = th.linspace(0, 999, n_points).type(th.int).numpy().tolist()
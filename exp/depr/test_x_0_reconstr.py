@@ -20,7 +20,7 @@ def main():
     classifier = _load_class(models_dir / "resnet_reconstruction_classifier_mnist.pt", device)
     T = 1000
     betas = improved_beta_schedule(num_timesteps=T)
-    time_steps = th.tensor([i for i in range(T)])
+    time_steps = th.arange(T)
     diff_sampler = DiffusionSampler(betas, time_steps)
     diff_sampler.to(device)
     num_samples = 100
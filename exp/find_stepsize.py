@@ -6,7 +6,6 @@ import sys
 sys.path.append(".")
 from argparse import ArgumentParser
 from pathlib import Path
-import pickle
 import torch as th
 from src.guidance.base import MCMCGuidanceSampler, MCMCGuidanceSamplerStacking
 from src.guidance.classifier_full import ClassifierFullGuidance
@@ -19,7 +18,7 @@ from src.samplers.mcmc import (
     AnnealedLAEnergySampler,
 )
 from src.model.resnet import load_classifier_t
-from src.utils.net import Device, get_device
+from src.utils.net import Device, get_device, set_cuda_backend_flags, free_cuda_memory
 from src.diffusion.base import DiffusionSampler
 from src.diffusion.beta_schedules import (
     improved_beta_schedule,
@@ -29,12 +28,13 @@ from src.diffusion.beta_schedules import (
 from src.model.guided_diff.unet import load_pretrained_diff_unet
 from src.model.guided_diff.classifier import load_guided_classifier
 from src.model.unet import load_mnist_diff
-from exp.utils import timestamp
+from exp.utils import timestamp, dense_step_size_path, dense_step_sizes
 from src.utils.seeding import set_seed
 from src.model.comp_two_d.diffusion import load_diff_model_gmm
 from src.model.comp_two_d.classifier import load_classifier
 import numpy as np
 from src.model.cifar.utils import get_diff_model, select_cifar_classifier
+from src.model.utils import prepare_models
 from src.data.cifar import CIFAR_100_NUM_CLASSES, CIFAR_IMAGE_SIZE, CIFAR_NUM_CHANNELS
 
 
@@ -55,6 +55,7 @@ def main():
     set_seed(args.seed)
     sim_dir = _setup_results_dir(Path.cwd() / "results", args)
     device = get_device(Device.GPU)
+    set_cuda_backend_flags()
     models_dir = Path.cwd() / "models"
     energy_param = "energy" in args.diff_model
     # uncond_diff = load_mnist_diff(models_dir / "uncond_unet_mnist.pt", device)
@@ -111,6 +112,12 @@ def main():
     else:
         raise ValueError('Not a valid name of diff-model')
 
+    dtype = getattr(th, args.dtype)
+    channels_last = dataset_name == "imagenet"
+    diff_model, classifier = prepare_models(
+        diff_model, classifier, dtype, channels_last, args.compile_model, energy_param
+    )
+
     respaced_T = args.respaced_num_diff_steps
 
     betas, time_steps = respaced_beta_schedule(
@@ -151,49 +158,73 @@ def main():
     max_iter = args.max_iter
 
     guidance = ClassifierFullGuidance(classifier, lambda_=args.guid_scale)
-    classes = th.randint(num_classes, (num_samples,), dtype=th.int64)
-    if batch_size < num_samples:
-        sampler = AdaptiveStepSizeConstantMCMCSamplerWrapperSmallBatchSize(
+    classes = th.randint(num_classes, (num_samples,), dtype=th.int64, device=device)
+    accept_rate_bound = [a / 100 for a in accept_rate_bound_pct]
+    # The adaptive wrapper updates the step sizes in place, keep the defaults for a sharded restart.
+    initial_step_sizes = dict(step_sizes)
+
+    # All chains are sampled simultaneously as one batch, only shard on the GPU if they do not fit.
+    print("Running Adaptive MCMC sampler")
+    try:
+        sampler = AdaptiveStepSizeConstantMCMCSamplerWrapper(
             sampler=mcmc_sampler,
-            accept_rate_bound=[a / 100 for a in accept_rate_bound_pct],
+            accept_rate_bound=accept_rate_bound,
             time_steps=time_steps,
-            batch_size=batch_size,
-            device=device,
             max_iter=max_iter,
         )
-
-        guided_sampler = MCMCGuidanceSamplerStacking(
+        guided_sampler = MCMCGuidanceSampler(
             diff_model=diff_model,
             diff_proc=diff_sampler,
             guidance=guidance,
             mcmc_sampler=sampler,
             diff_cond=args.class_cond,
+            channels_last=channels_last,
         )
-        samples, _ = guided_sampler.sample_stacking(
-            num_samples, batch_size, classes, device, size, verbose=True
-        )
-    else:
-        print("Running Adaptive MCMC sampler")
-        sampler = AdaptiveStepSizeConstantMCMCSamplerWrapper(
+        with th.autocast(device_type=device.type, dtype=dtype, enabled=dtype != th.float32):
+            samples, _ = guided_sampler.sample(num_samples, classes, device, size, verbose=True)
+        out_of_memory = False
+    except th.cuda.OutOfMemoryError:
+        if batch_size >= num_samples:
+            raise
+        out_of_memory = True
+
+    if out_of_memory:
+        print(f"{num_samples} chains do not fit in memory, sampling in batches of {batch_size}")
+        sampler, guided_sampler = None, None
+        free_cuda_memory()
+        mcmc_sampler.step_sizes = dict(initial_step_sizes)
+        # The failed attempt advanced the RNG, reseed so the fallback search is reproducible for a given seed
+        set_seed(args.seed)
+        classes = th.randint(num_classes, (num_samples,), dtype=th.int64, device=device)
+        sampler = AdaptiveStepSizeConstantMCMCSamplerWrapperSmallBatchSize(
             sampler=mcmc_sampler,
-            accept_rate_bound=[a / 100 for a in accept_rate_bound_pct],
+            accept_rate_bound=accept_rate_bound,
             time_steps=time_steps,
+            batch_size=batch_size,
+            device=device,
             max_iter=max_iter,
         )
-        guided_sampler = MCMCGuidanceSampler(
+
+        guided_sampler = MCMCGuidanceSamplerStacking(
             diff_model=diff_model,
             diff_proc=diff_sampler,
             guidance=guidance,
             mcmc_sampler=sampler,
             diff_cond=args.class_cond,
+            channels_last=channels_last,
         )
-        samples, _ = guided_sampler.sample(num_samples, classes, device, size, verbose=True)
+        with th.autocast(device_type=device.type, dtype=dtype, enabled=dtype != th.float32):
+            samples, _ = guided_sampler.sample_stacking(
+                num_samples, batch_size, classes, device, size, verbose=True
+            )
 
     adaptive_step_sizes = sampler.res
-    adaptive_step_sizes = best_step_size([a / 100 for a in accept_rate_bound_pct], adaptive_step_sizes)
+    adaptive_step_sizes = best_step_size(accept_rate_bound, adaptive_step_sizes)
     lower_bound, upper_bound = accept_rate_bound_pct
-    save_path = sim_dir / f"{args.mcmc}_{dataset_name}_{respaced_T}_{lower_bound}_{upper_bound}.p"
-    pickle.dump(adaptive_step_sizes, open(save_path, "wb"))
+    save_path = sim_dir / f"{args.mcmc}_{dataset_name}_{respaced_T}_{lower_bound}_{upper_bound}.pt"
+    th.save(adaptive_step_sizes, save_path)
+    # Best step sizes alone, as a tensor indexed by t (loaded memory-mapped by get_step_size)
+    th.save(dense_step_sizes(adaptive_step_sizes), dense_step_size_path(save_path))
 
 
 import json
@@ -233,7 +264,9 @@ def parse_args():
     parser = ArgumentParser(prog="Find step size for MCMC for classifier-full guidance")
     parser.add_argument("--guid_scale", default=20.0, type=float, help="Guidance scale")
     parser.add_argument("--num_diff_steps", default=1000, type=int, help="Num diffusion steps")
-    parser.add_argument("--batch_size", default=10, type=int, help="Batch size")
+    parser.add_argument(
+        "--batch_size", default=10, type=int, help="Batch size, used if all chains do not fit in memory"
+    )
     parser.add_argument("--num_samples", default=120, type=int, help="Number of samples for estimate acceptance ratio")
     parser.add_argument("--accept_rate_bound", default=[55, 65], nargs="+", type=float, help="Acceptance ratio bounds")
     parser.add_argument("--max_iter", default=50, type=int, help="Number of search iterations per time step")
@@ -251,6 +284,10 @@ def parse_args():
     parser.add_argument("--seed", type=int, default=None)
     parser.add_argument("--n_trapets", type=int, default=5, help="Number of trapets steps for LA")
     parser.add_argument("--n_intermediate_steps", type=int, default=0, help="Number of intermediate steps for HMC")
+    parser.add_argument("--compile_model", action="store_true", help="Compile diff. model and classifier")
+    parser.add_argument(
+        "--dtype", default="float32", type=str, choices=["float32", "bfloat16"], help="Inference precision"
+    )
     return parser.parse_args()
 
 
@@ -230,7 +230,7 @@ def get_guid_sampler(config, diff_model, diff_sampler, guidance, time_steps, dat
             print("Load step sizes for MCMC.")
             step_sizes = get_step_size(
                 MODELS_DIR / "step_sizes", dataset_name, config.mcmc_method, config.mcmc_stepsizes["bounds"],
-                str(config.num_diff_steps)
+                str(config.num_diff_steps), time_steps=time_steps
             )
         else:
             a = config.mcmc_stepsizes["params"]["factor"]
@@ -43,7 +43,7 @@ def main():
     models_dir = Path.cwd() / f"models/multi_dim_gmm_T_{num_diff_steps}/{sub_name}"
 
     betas = improved_beta_schedule(num_timesteps=num_diff_steps)
-    time_steps = th.tensor([i for i in range(num_diff_steps)])
+    time_steps = th.arange(num_diff_steps)
     diff_proc = DiffusionSampler(betas, time_steps, posterior_variance="beta")
 
     x_dim = args.x_dim
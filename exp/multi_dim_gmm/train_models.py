@@ -38,7 +38,7 @@ def main():
     # Diff params
     num_diff_steps = args.T
     betas = improved_beta_schedule(num_timesteps=num_diff_steps)
-    time_steps = th.tensor([i for i in range(num_diff_steps)])
+    time_steps = th.arange(num_diff_steps)
     diff_sampler = DiffusionSampler(betas, time_steps)
 
     if args.low_rank_dim is None:
@@ -39,7 +39,7 @@ def main():
     # Diff params
     num_diff_steps = 100
     betas = improved_beta_schedule(num_timesteps=num_diff_steps)
-    time_steps = th.tensor([i for i in range(num_diff_steps)])
+    time_steps = th.arange(num_diff_steps)
     diff_sampler = DiffusionSampler(betas, time_steps)
 
     if args.low_rank_dim is None:
@@ -3,6 +3,7 @@ import sys
 
 
 sys.path.append(".")
+from contextlib import nullcontext
 from pathlib import Path
 from argparse import ArgumentParser
 import torch as th
@@ -15,27 +16,35 @@ from src.diffusion.beta_schedules import (
 from src.guidance.classifier_full import ClassifierFullGuidance
 from src.samplers.utils import get_guid_sampler
 
-from src.model.utils import load_models
+from src.model.utils import load_models, prepare_models
 
 # Exp setup
 from src.utils.seeding import set_seed
-from src.utils.net import get_device, Device
+from src.utils.net import get_device, Device, set_cuda_backend_flags, free_cuda_memory
 from exp.utils import SimulationConfig, setup_results_dir
 
 
 def main():
     args = parse_args()
     config = SimulationConfig.from_json(args.config)
-    assert config.num_samples % config.batch_size == 0, "num_samples should be a multiple of batch_size"
+    assert (
+        config.auto_batch or config.num_samples % config.batch_size == 0
+    ), "num_samples should be a multiple of batch_size"
     set_seed(config.seed)
 
     # Setup and assign a directory where simulation results are saved.
     sim_dir = setup_results_dir(config, args.job_id)
     device = get_device(Device.GPU)
+    set_cuda_backend_flags()
 
     # Load diff. and classifier models
     (diff_model, classifier, dataset, beta_schedule, post_var, energy_param) = load_models(config, device, MODELS_DIR)
     dataset_name, image_size, num_classes, num_channels = dataset
+    dtype = getattr(th, config.dtype)
+    channels_last = dataset_name == "imagenet"
+    diff_model, classifier = prepare_models(
+        diff_model, classifier, dtype, channels_last, config.compile_model, energy_param
+    )
 
     betas, time_steps = respaced_beta_schedule(
         original_betas=beta_schedule(num_timesteps=config.num_diff_steps),
@@ -45,25 +54,76 @@ def main():
     diff_sampler = DiffusionSampler(betas, time_steps, posterior_variance=post_var)
     guidance = ClassifierFullGuidance(classifier, lambda_=config.guid_scale)
     guid_sampler = get_guid_sampler(config, diff_model, diff_sampler, guidance, time_steps, dataset_name, energy_param,
-                                    MODELS_DIR, save_grad=args.save_grad)
+                                    MODELS_DIR, save_grad=args.save_grad, channels_last=channels_last)
 
     print("Sampling...")
-    for batch in range(config.num_samples // config.batch_size):
-        print(f"{(batch+1) * config.batch_size}/{config.num_samples}")
-        classes = th.randint(low=0, high=num_classes, size=(config.batch_size,)).long().to(device)
-        samples, _ = guid_sampler.sample(
-            config.batch_size, classes, device, th.Size((num_channels, image_size, image_size)), verbose=True
+    # Double buffered (pinned) host copies of the samples: the D2H copy of a batch is not waited on,
+    # the previous batch is written to disk while it is in flight.
+    use_cuda = device.type == "cuda"
+    host_bufs = [None, None]
+    pending = None
+    # With auto_batch, try all samples in one batch first and halve the batch size on OOM
+    batch_size = config.num_samples if config.auto_batch else config.batch_size
+    # Device resident class buffers, refilled in place. Two of them, since a batch is saved one iteration later.
+    # The batch size only ever decreases, so a prefix view of the buffer is used.
+    classes_bufs = [th.empty((batch_size,), dtype=th.int64, device=device) for _ in range(2)]
+    num_sampled, batch = 0, 0
+    while num_sampled < config.num_samples:
+        batch_size = min(batch_size, config.num_samples - num_sampled)
+        print(f"{num_sampled + batch_size}/{config.num_samples}")
+        classes = classes_bufs[batch % 2][:batch_size].random_(0, num_classes)
+        # Route attention through the fused SDPA kernels, no fallback to the (T x T materialising) math kernel
+        sdp_ctx = (
+            th.backends.cuda.sdp_kernel(enable_flash=True, enable_mem_efficient=True, enable_math=False)
+            if device.type == "cuda"
+            else nullcontext()
         )
-        samples = samples.detach().cpu()
-        th.save(samples, sim_dir / f"samples_{args.sim_batch}_{batch}.th")
-        th.save(classes, sim_dir / f"classes_{args.sim_batch}_{batch}.th")
+        try:
+            with sdp_ctx, th.autocast(device_type=device.type, dtype=dtype, enabled=dtype != th.float32):
+                samples, _ = guid_sampler.sample(
+                    batch_size, classes, device, th.Size((num_channels, image_size, image_size)), verbose=True
+                )
+            out_of_memory = False
+        except th.cuda.OutOfMemoryError:
+            if not config.auto_batch or batch_size == 1:
+                raise
+            out_of_memory = True
+
+        if out_of_memory:
+            batch_size //= 2
+            print(f"Out of memory, retrying with batch size {batch_size}")
+            free_cuda_memory()
+            continue
+        host_samples = host_bufs[batch % 2]
+        if host_samples is None or host_samples.shape != samples.shape:
+            host_samples = th.empty(samples.shape, dtype=samples.dtype, pin_memory=use_cuda)
+            host_bufs[batch % 2] = host_samples
+        host_samples.copy_(samples.detach(), non_blocking=use_cuda)
+        copy_done = None
+        if use_cuda:
+            copy_done = th.cuda.Event()
+            copy_done.record()
+        if pending is not None:
+            _save_batch(sim_dir, args.sim_batch, *pending)
+        pending = (batch, host_samples, classes, copy_done)
         if (config.mcmc_method == "hmc" or config.mcmc_method == "la") and args.sim_batch == 1 and batch == 0:
             guid_sampler.mcmc_sampler.save_stats_to_file(dir_=sim_dir, suffix=f"{args.sim_batch}_{batch}")
         if args.save_grad and args.sim_batch == 1 and batch == 0:
             guid_sampler.save_grads_to_file(dir_=sim_dir, suffix=f"{args.sim_batch}_{batch}")
+        num_sampled += batch_size
+        batch += 1
+    if pending is not None:
+        _save_batch(sim_dir, args.sim_batch, *pending)
     print(f"Results written to '{sim_dir}'")
 
 
+def _save_batch(sim_dir: Path, sim_batch: int, batch: int, host_samples: th.Tensor, classes: th.Tensor, copy_done):
+    if copy_done is not None:
+        copy_done.synchronize()
+    th.save(host_samples, sim_dir / f"samples_{sim_batch}_{batch}.th")
+    th.save(classes.cpu(), sim_dir / f"classes_{sim_batch}_{batch}.th")
+
+
 MODELS_DIR = Path.cwd() / "models"
 
 
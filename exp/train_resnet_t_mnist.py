@@ -38,7 +38,7 @@ def main():
     resnet.train()
 
     betas = improved_beta_schedule(num_timesteps=num_diff_steps)
-    time_steps = th.tensor([i for i in range(num_diff_steps)])
+    time_steps = th.arange(num_diff_steps)
     noise_scheduler = DiffusionSampler(betas, time_steps)
 
     diff_classifier = DiffusionClassifier(
@@ -4,7 +4,9 @@ from pathlib import Path
 import json
 from datetime import datetime
 from copy import deepcopy
+import inspect
 import pickle
+import torch as th
 
 
 
@@ -45,6 +47,15 @@ class SimulationConfig:
     save_traj: bool = False
     results_dir: Path = Path.cwd() / "results"
     t_skip: int = 0
+    # Wrap diff. model and classifier with th.compile (Inductor + CUDA graphs)
+    compile_model: bool = False
+    # Compute classifier guidance gradient and diff. model forward in one compiled function
+    fuse_guidance: bool = False
+    # Inference precision: "float32" or "bfloat16". No float16: the guidance gradient is taken in dtype, unscaled,
+    # and would underflow.
+    dtype: str = "float32"
+    # Sample all num_samples in one batch, halving the batch size on OOM (batch_size is then ignored)
+    auto_batch: bool = False
 
     @staticmethod
     def load(cfg_file_path: Path):
@@ -82,6 +93,7 @@ class SimulationConfig:
                 assert self.mcmc_stepsizes["beta_schedule"] is not None
             if self.mcmc_method == "la":
                 assert isinstance(self.n_trapets, int)
+        assert self.dtype in ("float32", "bfloat16"), f"Unsupported dtype '{self.dtype}'"
 
     def save(self, sim_dir: Path, suffix = ""):
         tmp_config = deepcopy(self)
@@ -134,13 +146,60 @@ class UnguidedSimulationConfig:
             json.dump(asdict(tmp_config), outfile, indent=4, sort_keys=False)
 
 
-def get_step_size(step_size_dir: Path, dataset_name: str, mcmc_method: str, mcmc_accept_bounds: str, num_steps: str):
-    path = step_size_dir / f"{mcmc_method}_{dataset_name}_{num_steps}_{mcmc_accept_bounds}.p"
-    assert path.exists(), f"Step size file '{path}' not found"
-    with open(path, "rb") as f:
-        res = pickle.load(f)
+# th.load(mmap=...) is only available from torch 2.1
+_TH_LOAD_MMAP = "mmap" in inspect.signature(th.load).parameters
 
-    step_size = {k: v for k, v in zip([i for i in range(len(res['best']['step_sizes']))], res['best']['step_sizes'])}
+
+def get_step_size(step_size_dir: Path, dataset_name: str, mcmc_method: str, mcmc_accept_bounds: str, num_steps: str,
+                  time_steps: Optional[th.Tensor] = None):
+    """Load the best step sizes of a step size search as a tensor indexed by t
+
+    If time_steps (the respaced time steps of the sampler) is given, every time step MCMC is run at,
+    time_steps[:-1], must have a (finite) step size. Missing ones are NaN, which would silently turn samples into NaN.
+    """
+    step_size = _load_step_size(step_size_dir, dataset_name, mcmc_method, mcmc_accept_bounds, num_steps)
+    if time_steps is not None:
+        mcmc_time_steps = time_steps[:-1].long()
+        assert (
+            mcmc_time_steps.max() < step_size.size(0) and th.isfinite(step_size[mcmc_time_steps]).all()
+        ), f"Step sizes for {mcmc_method} {dataset_name} do not cover the sampled time steps"
+    return step_size
+
+
+def _load_step_size(step_size_dir: Path, dataset_name: str, mcmc_method: str, mcmc_accept_bounds: str, num_steps: str):
+    path = step_size_dir / f"{mcmc_method}_{dataset_name}_{num_steps}_{mcmc_accept_bounds}.pt"
+    dense_path = dense_step_size_path(path)
+    # The search result is the source of truth, use the dense file only if no result next to it is newer
+    results = [p for p in (path, path.with_suffix(".p")) if p.exists()]
+    if dense_path.exists():
+        if all(dense_path.stat().st_mtime >= p.stat().st_mtime for p in results):
+            # Memory-mapped (where supported), parallel sim. batches share the page cache
+            mmap_kwargs = {"mmap": True} if _TH_LOAD_MMAP else {}
+            return th.load(dense_path, map_location="cpu", weights_only=True, **mmap_kwargs)
+        print(f"Ignoring '{dense_path}', it is older than the step size search result")
+    if path.exists():
+        res = th.load(path, map_location="cpu", weights_only=True)
+    else:
+        # Legacy pickled step sizes
+        path = path.with_suffix(".p")
+        assert path.exists(), f"Step size file '{path.with_suffix('.pt')}' not found"
+        with open(path, "rb") as f:
+            res = pickle.load(f)
+    return dense_step_sizes(res)
+
+
+def dense_step_size_path(path: Path) -> Path:
+    """Path of the dense step size tensor that accompanies a step size search result at 'path'"""
+    return path.with_name(f"{path.stem}_dense.pt")
+
+
+def dense_step_sizes(res: dict) -> th.Tensor:
+    """Best step sizes of a step size search result as a tensor indexed by time step"""
+    # 'best' holds one step size per sorted time step, bar the last (see find_stepsize.best_step_size)
+    time_steps = sorted(k for k in res.keys() if isinstance(k, int))[:-1]
+    # Dense lookup indexed by time step, NaN marks time steps without a step size
+    step_size = th.full((time_steps[-1] + 1,), float("nan"))
+    step_size[th.tensor(time_steps)] = th.tensor(res['best']['step_sizes'], dtype=step_size.dtype)
     return step_size
 
 
@@ -57,7 +57,7 @@ class ProductCompSampler:
         """
 
         steps = []
-        x_tm1 = th.randn((num_samples,) + shape).to(device)
+        x_tm1 = th.randn((num_samples,) + shape, device=device)
         steps.append(x_tm1.clone().detach().cpu())
         self.verbose_counter = 0
 
@@ -91,7 +91,7 @@ class ProductCompSampler:
         """
 
         steps = []
-        x_tm1 = th.randn((num_samples,) + shape).to(device)
+        x_tm1 = th.randn((num_samples,) + shape, device=device)
         steps.append(x_tm1.clone().detach().cpu())
         self.verbose_counter = 0
 
@@ -90,7 +90,7 @@ class DiffusionSampler(ABC):
     @th.no_grad()
     def _sample(self, model: nn.Module, num_samples: int, device: th.device, shape: tuple, verbose=False):
         steps = []
-        x_tm1 = th.randn((num_samples,) + shape).to(device)
+        x_tm1 = th.randn((num_samples,) + shape, device=device)
         verbose_counter = 0
 
         for t, t_idx in zip(self.time_steps.__reversed__(), reversed(self.time_steps_idx)):
@@ -116,7 +116,7 @@ class DiffusionSampler(ABC):
 
     def _sample_require_grad(self, model: nn.Module, num_samples: int, device: th.device, shape: tuple, verbose=False):
         steps = []
-        x_tm1 = th.randn((num_samples,) + shape).to(device)
+        x_tm1 = th.randn((num_samples,) + shape, device=device)
         verbose_counter = 0
         # import time
         for t, t_idx in zip(self.time_steps.__reversed__(), reversed(self.time_steps_idx)):
@@ -276,7 +276,7 @@ def extract(a: th.Tensor, t: Union[int, th.Tensor], x: th.Tensor):
 
     batch_size = x.shape[0]
     device = a.device
-    inds = th.full((batch_size,), t).to(device) if isinstance(t, int) else t.to(device)
+    inds = th.full((batch_size,), t, device=device) if isinstance(t, int) else t.to(device)
     out = a.gather(-1, inds)
     return out.reshape(batch_size, *((1,) * (len(x.shape) - 1))).to(x.device)
 
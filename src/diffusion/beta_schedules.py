@@ -1,12 +1,25 @@
 """Beta schedules"""
 import math
+from functools import lru_cache, wraps
 from typing import Tuple
-from copy import copy
 import torch as th
 
 from src.diffusion.base import compute_alpha_bars
 
 
+def _cached_schedule(fn):
+    """Memoize a schedule of hashable arguments, returning a copy so callers cannot alter the cached tensor"""
+    cached_fn = lru_cache(maxsize=8)(fn)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return cached_fn(*args, **kwargs).clone()
+
+    wrapper.cache_clear = cached_fn.cache_clear
+    return wrapper
+
+
+@_cached_schedule
 def linear_beta_schedule(beta_start: float = 1e-4, beta_end: float = 0.02, num_timesteps: int = 200) -> th.Tensor:
     """Generate linearly spaced betas
 
@@ -22,6 +35,7 @@ def linear_beta_schedule(beta_start: float = 1e-4, beta_end: float = 0.02, num_t
     return betas
 
 
+@_cached_schedule
 def improved_beta_schedule(num_timesteps: int, s: float = 0.008, beta_max: float = 0.999) -> th.Tensor:
     """Improved beta schedulce
 
@@ -58,6 +72,7 @@ def respaced_beta_schedule(original_betas: th.Tensor, T: int, respaced_T) -> Tup
     return betas, time_steps
 
 
+@_cached_schedule
 def respaced_timesteps(num_timesteps: int, desired_num_timesteps: int) -> th.Tensor:
     frac_stride = (num_timesteps - 1) / (desired_num_timesteps - 1)
     time_steps_respace = []
@@ -70,20 +85,12 @@ def respaced_timesteps(num_timesteps: int, desired_num_timesteps: int) -> th.Ten
 
 
 def respaced_betas(use_timesteps: th.Tensor, original_betas: th.Tensor) -> th.Tensor:
-    original_betas = copy(original_betas)
-    # timestep_map = []
-
     alphas_cumprod = compute_alpha_bars((1 - original_betas))
-    last_alpha_cumprod = 1.0
-    new_betas = []
-    for i, alpha_cumprod in enumerate(alphas_cumprod):
-        if i in use_timesteps:
-            new_beta = 1 - alpha_cumprod / last_alpha_cumprod
-            # print(f"a_bar: {alpha_cumprod}, last_a_bar: {last_alpha_cumprod}, new b: {new_beta}")
-            new_betas.append(new_beta)
-            last_alpha_cumprod = alpha_cumprod
-            # timestep_map.append(i)
-    return th.tensor(new_betas)
+    # Sorted and unique, as the kept steps are visited in increasing order
+    use_timesteps = th.unique(use_timesteps)
+    alpha_cumprod = alphas_cumprod[use_timesteps]
+    last_alpha_cumprod = th.cat((th.ones((1,), dtype=alpha_cumprod.dtype), alpha_cumprod[:-1]))
+    return 1 - alpha_cumprod / last_alpha_cumprod
 
 
 # def sparse_beta_schedule(og_betas: th.Tensor, sparse_factor: int) -> th.Tensor:
@@ -155,6 +162,6 @@ if __name__ == "__main__":
     respace = 250
     ts = respaced_timesteps(T, respace)
     betas = linear_beta_schedule(num_timesteps=T)
-    betas_new = new_sparse(ts, betas)
+    betas_new = respaced_betas(ts, betas)
     print(betas)
     print(betas_new)
@@ -40,7 +40,7 @@ class GuidanceSampler:
     """Sampling from classifier guided DDPM"""
 
     def __init__(self, diff_model: nn.Module, diff_proc: DiffusionSampler, guidance: Guidance, diff_cond: bool = False,
-                 save_grad=False):
+                 save_grad=False, fuse_guidance: bool = False, channels_last: bool = False):
         self.diff_model = diff_model
         self.diff_proc = diff_proc
         self.guidance = guidance
@@ -52,6 +52,13 @@ class GuidanceSampler:
             self.require_g = True
 
         self.save_grad = save_grad
+        # Guidance gradient and diff. model forward of the reverse step as one compiled function
+        self._fused_pred_noise = None
+        if fuse_guidance:
+            assert not (self.require_g or save_grad), "Fused guidance requires a score model and save_grad=False"
+            self._fused_pred_noise = th.compile(self.guidance.guided_pred_noise, mode="reduce-overhead")
+        # Layout of x fed to the diff. model, channels_last requires the models to be converted as well
+        self.memory_format = th.channels_last if channels_last else th.contiguous_format
         # Seed only for noise in reverse step
         # current_rng_state = th.get_rng_state()
         # initial_seed = th.initial_seed()
@@ -81,7 +88,7 @@ class GuidanceSampler:
         """
 
         full_trajs = []
-        x_tm1 = th.randn((num_samples,) + shape).to(device)
+        x_tm1 = th.randn((num_samples,) + shape, device=device)
         full_trajs.append(x_tm1.detach().cpu())
         self.verbose_counter = 0
 
@@ -149,9 +156,11 @@ class MCMCGuidanceSampler(GuidanceSampler):
         reverse=True,
         diff_cond: bool = False,
         save_grad: bool = False,
+        fuse_guidance: bool = False,
+        channels_last: bool = False,
     ):
         super().__init__(diff_model=diff_model, diff_proc=diff_proc, guidance=guidance, diff_cond=diff_cond,
-                         save_grad=save_grad)
+                         save_grad=save_grad, fuse_guidance=fuse_guidance, channels_last=channels_last)
         self.mcmc_sampler = mcmc_sampler
         # Function which maps diff step t to a bool, controlling for which timesteps to MCMC sampling.
         self._mcmc_sampling_predicate = mcmc_sampling_predicate
@@ -163,15 +172,18 @@ class MCMCGuidanceSampler(GuidanceSampler):
         self.mcmc_sampler.set_grad_diff(self.grad_diff)
 
     def grad_diff(self, x_t, t, t_idx, classes):
+        x_t = x_t.contiguous(memory_format=self.memory_format)
         sigma_t = self.diff_proc.sigma_t(t_idx, x_t)
         t_tensor = th.full((x_t.shape[0],), t, device=x_t.device)
         args = [x_t, t_tensor]
         if self.diff_cond:
             args += [classes]
-        if not isinstance(self.diff_proc.posterior_variance, str):
-            pred_noise = self.diff_model(*args)
-        else:
-            pred_noise, _ = self.diff_model(*args).split(x_t.size(1), dim=1)
+        # Score parameterised models need no autograd, energy parameterised differentiate the energy in forward.
+        with th.inference_mode(not self.require_g):
+            if not isinstance(self.diff_proc.posterior_variance, str):
+                pred_noise = self.diff_model(*args)
+            else:
+                pred_noise, _ = self.diff_model(*args).split(x_t.size(1), dim=1)
         return - pred_noise / sigma_t
 
     def class_log_prob(self, x_t, t, t_idx, classes):
@@ -220,7 +232,7 @@ class MCMCGuidanceSampler(GuidanceSampler):
         """
 
         full_trajs = []
-        x_tm1 = th.randn((num_samples,) + shape).to(device)
+        x_tm1 = th.randn((num_samples,) + shape, device=device)
         full_trajs.append(x_tm1.detach().cpu())
 
         verbose_counter = 0
@@ -255,6 +267,7 @@ class MCMCGuidanceSamplerStacking(MCMCGuidanceSampler):
         mcmc_sampler: MCMCSampler,
         reverse: bool = True,
         diff_cond: bool = False,
+        channels_last: bool = False,
     ):
         super().__init__(
             diff_model=diff_model,
@@ -263,6 +276,7 @@ class MCMCGuidanceSamplerStacking(MCMCGuidanceSampler):
             mcmc_sampler=mcmc_sampler,
             reverse=reverse,
             diff_cond=diff_cond,
+            channels_last=channels_last,
         )
 
     def sample_stacking(self, num_samples: int, batch_size: int, classes: th.Tensor, device: th.device, shape: tuple,
@@ -335,7 +349,7 @@ class GuidanceSamplerAcceptanceComparison:
         """
 
         assert all([isinstance(self.guidance_models[i].mcmc_sampler, MCMCMHCorrSampler) for i in range(self.n_models)])
-        x_tm1 = th.randn((num_samples,) + shape).to(device)
+        x_tm1 = th.randn((num_samples,) + shape, device=device)
         acceptance = {
             i: {j.item(): list() for j in self.guidance_models[i].diff_proc.time_steps} for i in range(self.n_models)
         }
@@ -414,7 +428,7 @@ class GuidanceSamplerAcceptanceComparison:
 
         for i_model in range(self.n_models):
             verbose_counter = 0
-            x_tm1 = th.randn((num_samples,) + shape).to(device)
+            x_tm1 = th.randn((num_samples,) + shape, device=device)
             self_ = self.guidance_models[i_model]
             for t, t_idx in zip(self_.diff_proc.time_steps.__reversed__(), reversed(self_.diff_proc.time_steps_idx)):
                 if verbose and self_.diff_proc.verbose_split[verbose_counter] == t:
@@ -511,21 +525,35 @@ class GuidanceSamplerAcceptanceComparison:
 
 @th.no_grad()
 def reverse_func(model, t, t_idx, x_tm1, classes, device, diff_cond):
+    x_tm1 = x_tm1.contiguous(memory_format=model.memory_format)
     t_tensor = th.full((x_tm1.shape[0],), t.item(), device=device)
     t_idx_tensor = th.full((x_tm1.shape[0],), t_idx, device=device)
     # Use the model to predict noise and use the noise to step back
     args = [x_tm1, t_tensor]
     if diff_cond:
         args += [classes.to(device)]
-    if not isinstance(model.diff_proc.posterior_variance, str):
-        pred_noise = model.diff_model(*args)
-        assert pred_noise.size() == x_tm1.size()
-        sqrt_post_var_t = th.sqrt(extract(model.diff_proc.posterior_variance, t_idx, x_tm1))
-    else:
-        pred_noise, log_var = model.diff_model(*args).split(x_tm1.size(1), dim=1)
-        assert pred_noise.size() == x_tm1.size()
-        log_var, _ = model.diff_proc._clip_var(x_tm1, t_idx_tensor, log_var)
-        sqrt_post_var_t = th.exp(0.5 * log_var)
+    if model._fused_pred_noise is not None:
+        # As in _sample_x_tm1_given_x_t, the classifier is conditioned on the time step index
+        sigma_t = model.diff_proc.sigma_t(t_idx, x_tm1)
+        pred_noise, out = model._fused_pred_noise(model.diff_model, x_tm1, args[1:], t_idx_tensor, classes, sigma_t)
+        if not isinstance(model.diff_proc.posterior_variance, str):
+            sqrt_post_var_t = th.sqrt(extract(model.diff_proc.posterior_variance, t_idx, x_tm1))
+        else:
+            log_var, _ = model.diff_proc._clip_var(x_tm1, t_idx_tensor, out[:, x_tm1.size(1):])
+            sqrt_post_var_t = th.exp(0.5 * log_var)
+        # The guidance is already in pred_noise, so take the plain DDPM step
+        return model.diff_proc._sample_x_tm1_given_x_t(x_tm1, t_idx, pred_noise, sqrt_post_var_t=sqrt_post_var_t)
+    # Only the diff. model forward; the guidance gradient in _sample_x_tm1_given_x_t needs autograd.
+    with th.inference_mode():
+        if not isinstance(model.diff_proc.posterior_variance, str):
+            pred_noise = model.diff_model(*args)
+            assert pred_noise.size() == x_tm1.size()
+            sqrt_post_var_t = th.sqrt(extract(model.diff_proc.posterior_variance, t_idx, x_tm1))
+        else:
+            pred_noise, log_var = model.diff_model(*args).split(x_tm1.size(1), dim=1)
+            assert pred_noise.size() == x_tm1.size()
+            log_var, _ = model.diff_proc._clip_var(x_tm1, t_idx_tensor, log_var)
+            sqrt_post_var_t = th.exp(0.5 * log_var)
     x_tm1 = model._sample_x_tm1_given_x_t(x_tm1, t_idx, pred_noise, sqrt_post_var_t=sqrt_post_var_t, classes=classes)
     return x_tm1
 
@@ -533,7 +561,7 @@ def reverse_func(model, t, t_idx, x_tm1, classes, device, diff_cond):
 def reverse_func_require_grad(model, t, t_idx, x_tm1, classes, device, diff_cond):
     t_tensor = th.full((x_tm1.shape[0],), t.item(), device=device)
     t_idx_tensor = th.full((x_tm1.shape[0],), t_idx, device=device)
-    x_tm1 = x_tm1.requires_grad_(True)
+    x_tm1 = x_tm1.contiguous(memory_format=model.memory_format).requires_grad_(True)
     # Use the model to predict noise and use the noise to step back
     args = [x_tm1, t_tensor]
     if diff_cond:
@@ -7,6 +7,7 @@ That is, we need access to a classifier for all noise levels.
 """
 import torch as th
 from torch import nn
+import torch.nn.functional as F
 from src.guidance.base import Guidance
 from src.utils.classification import logits_to_log_prob
 from src.utils.net import batch_grad
@@ -25,24 +26,47 @@ class ClassifierFullGuidance(Guidance):
     def grad(self, x_t, t, y, pred_noise, scale=False):
         """Compute score function for the classifier"""
         if self.lambda_ > 0.0:
-            th.set_grad_enabled(True)
-            # I do not know if this is correct, or even necessary.
-            x_t = x_t.clone().detach().requires_grad_(True)
-            logits = self.classifier(x_t, t)
-            log_p = logits_to_log_prob(logits)
-            # Get the log. probabilities of the correct classes
-            y_log_probs = log_p[th.arange(log_p.size(0)), y]
-            grad_ = batch_grad(y_log_probs, x_t)
+            with th.enable_grad():
+                # I do not know if this is correct, or even necessary.
+                x_t = x_t.clone().detach().requires_grad_(True)
+                logits = self.classifier(x_t, t)
+                log_p = logits_to_log_prob(logits)
+                # Get the log. probabilities of the correct classes
+                y_log_probs = log_p[th.arange(log_p.size(0)), y]
+                grad_ = batch_grad(y_log_probs, x_t)
 
             s = 1.0
             if scale:
                 s = th.norm(pred_noise) / grad_.norm()
             grad_ = self.lambda_ * grad_ * s
-            th.set_grad_enabled(False)
         else:
             grad_ = th.zeros_like(x_t)
         return grad_
 
+    def guided_pred_noise(self, diff_model, x_t, diff_args, t, y, sigma_t):
+        """Guided noise prediction eps_theta(x_t, t) - sigma_t * lambda_ * grad log p(y | x_t, t)
+
+        Runs the classifier forward, the gradient w.r.t. x_t and the diff. model forward in one function,
+        so that the whole guided noise prediction can be captured by a single th.compile call.
+
+        @param diff_model: Noise prediction model, called as diff_model(x_t, *diff_args)
+        @param diff_args: Remaining args to the diff. model (time step, and classes if class conditional)
+        @param t: Time step tensor for the classifier
+        @param sigma_t: sqrt(1 - alpha_bar_t), broadcastable to x_t
+
+        Returns:
+            guided noise prediction, raw diff. model output (with learned variance channels, if any)
+        """
+        with th.enable_grad():
+            x_in = x_t.detach().requires_grad_(True)
+            logits = self.classifier(x_in, t)
+            # Rows are independent, so the gradient of the sum is the per sample gradient
+            y_log_probs = F.log_softmax(logits, dim=-1).gather(1, y[:, None]).sum()
+            grad_ = th.autograd.grad(y_log_probs, x_in)[0]
+        out = diff_model(x_t, *diff_args)
+        pred_noise = out[:, : x_t.size(1)]
+        return pred_noise - sigma_t * self.lambda_ * grad_, out
+
     @th.no_grad()
     def log_prob(self, x_t, t, y):
         logits = self.classifier(x_t, t)
@@ -161,7 +161,7 @@ class SinusoidalPositionEmbeddings(nn.Module):
 
     def forward(self, time: th.Tensor):
         device = time.device
-        embeddings = 1.0 / 10000 ** (2.0 / self.dim * th.tensor([i // 2 for i in range(self.dim)], device=device))
+        embeddings = 1.0 / 10000 ** (2.0 / self.dim * (th.arange(self.dim, device=device) // 2))
         embeddings = time[:, None] * embeddings[None, :]
         embeddings[:, ::2] = embeddings[:, ::2].sin()
         embeddings[:, 1::2] = embeddings[:, 1::2].cos()
@@ -7,8 +7,6 @@ from abc import abstractmethod
 from typing import Optional
 from pathlib import Path
 
-import math
-
 import numpy as np
 import torch as th
 import torch.nn as nn
@@ -733,11 +731,10 @@ class QKVAttentionLegacy(nn.Module):
         assert width % (3 * self.n_heads) == 0
         ch = width // (3 * self.n_heads)
         q, k, v = qkv.reshape(bs * self.n_heads, ch * 3, length).split(ch, dim=1)
-        scale = 1 / math.sqrt(math.sqrt(ch))
-        weight = th.einsum("bct,bcs->bts", q * scale, k * scale)  # More stable with f16 than dividing afterwards
-        weight = th.softmax(weight.float(), dim=-1).type(weight.dtype)
-        a = th.einsum("bts,bcs->bct", weight, v)
-        return a.reshape(bs, -1, length)
+        # Fused kernel (flash / mem. efficient) expects contiguous [N x H x T x C], default scale is 1 / sqrt(C)
+        q, k, v = map(lambda t: t.reshape(bs, self.n_heads, ch, length).transpose(-1, -2).contiguous(), (q, k, v))
+        a = F.scaled_dot_product_attention(q, k, v)
+        return a.transpose(-1, -2).reshape(bs, -1, length)
 
     @staticmethod
     def count_flops(model, _x, y):
@@ -764,15 +761,10 @@ class QKVAttention(nn.Module):
         assert width % (3 * self.n_heads) == 0
         ch = width // (3 * self.n_heads)
         q, k, v = qkv.chunk(3, dim=1)
-        scale = 1 / math.sqrt(math.sqrt(ch))
-        weight = th.einsum(
-            "bct,bcs->bts",
-            (q * scale).view(bs * self.n_heads, ch, length),
-            (k * scale).view(bs * self.n_heads, ch, length),
-        )  # More stable with f16 than dividing afterwards
-        weight = th.softmax(weight.float(), dim=-1).type(weight.dtype)
-        a = th.einsum("bts,bcs->bct", weight, v.reshape(bs * self.n_heads, ch, length))
-        return a.reshape(bs, -1, length)
+        # Fused kernel (flash / mem. efficient) expects contiguous [N x H x T x C], default scale is 1 / sqrt(C)
+        q, k, v = map(lambda t: t.reshape(bs, self.n_heads, ch, length).transpose(-1, -2).contiguous(), (q, k, v))
+        a = F.scaled_dot_product_attention(q, k, v)
+        return a.transpose(-1, -2).reshape(bs, -1, length)
 
     @staticmethod
     def count_flops(model, _x, y):
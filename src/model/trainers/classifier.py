@@ -56,10 +56,13 @@ class DiffusionClassifier(pl.LightningModule):
         self.weight_decay = weight_decay
 
         # Default Initialization
-        self.train_loss = 0.0
-        self.val_loss = 0.0
-        self.val_loss0 = 0.0
-        self.val_acc0 = 0.0
+        # Running sums are kept on device (non-persistent buffers follow the module), synced once per epoch
+        self.register_buffer("train_loss", th.zeros(()), persistent=False)
+        self.register_buffer("val_loss", th.zeros(()), persistent=False)
+        self.register_buffer("val_loss0", th.zeros(()), persistent=False)
+        self.register_buffer("val_acc0", th.zeros(()), persistent=False)
+        # Reproducible validation time steps, created on first use (the module device is not final in __init__)
+        self.val_gen = None
         self.i_batch_train = 0
         self.i_batch_val = 0
         self.i_epoch = 0
@@ -81,28 +84,29 @@ class DiffusionClassifier(pl.LightningModule):
         x_noisy = self.noise_scheduler.q_sample(x_0=x, ts=ts, noise=noise)
         predicted_y = self.model(x_noisy, ts)
         loss = self.loss_f(predicted_y, y)
-        self.train_loss += loss.detach().cpu().item()
+        self.train_loss += loss.detach()
         self.i_batch_train += 1
         self.log("train_loss", self.train_loss / self.i_batch_train)
         return loss
 
     def on_train_epoch_end(self):
-        print(" {}. Train Loss: {}".format(self.i_epoch, self.train_loss / self.i_batch_train))
-        self.train_loss = 0.0
+        print(" {}. Train Loss: {}".format(self.i_epoch, self.train_loss.item() / self.i_batch_train))
+        self.train_loss.zero_()
         self.i_batch_train = 0
         self.i_epoch += 1
 
     def validation_step(self, batch, batch_idx):
         batch_size, x, y = self._batch_fn(batch, self.device)
 
-        # rng_state = th.get_rng_state()
-        # th.manual_seed(self.i_batch_val)
+        # Dedicated generator, seeded per val. batch, leaves the global RNG state untouched
+        if self.val_gen is None or self.val_gen.device != self.device:
+            self.val_gen = th.Generator(device=self.device)
+        self.val_gen.manual_seed(self.i_batch_val)
 
         T = self.noise_scheduler.time_steps.size(0)
         # Only report val. acc for t=0
-        ts = th.randint(0, T, (batch_size,), device=self.device).long()
+        ts = th.randint(0, T, (batch_size,), device=self.device, generator=self.val_gen).long()
         ts0 = th.zeros((batch_size,), device=self.device).long()
-        # th.set_rng_state(rng_state)
         logits0 = self.model(x, ts0)
         loss0 = self.loss_f(logits0, y)
         acc0 = accuracy(hard_label_from_logit(logits0), y)
@@ -110,9 +114,9 @@ class DiffusionClassifier(pl.LightningModule):
         logits = self.model(x, ts)
         loss = self.loss_f(logits, y)
 
-        self.val_loss += loss.detach().cpu().item()
-        self.val_loss0 += loss0.detach().cpu().item()
-        self.val_acc0 += acc0.detach().cpu().item()
+        self.val_loss += loss.detach()
+        self.val_loss0 += loss0.detach()
+        self.val_acc0 += acc0.detach()
         self.i_batch_val += 1
 
         val_loss0 = self.val_loss0 / self.i_batch_val
@@ -124,13 +128,13 @@ class DiffusionClassifier(pl.LightningModule):
         return loss0
 
     def on_validation_epoch_end(self):
-        val_loss0 = self.val_loss0 / self.i_batch_val
-        val_loss = self.val_loss / self.i_batch_val
-        val_acc_pct_0 = (self.val_acc0 / self.i_batch_val) * 100
+        val_loss0 = self.val_loss0.item() / self.i_batch_val
+        val_loss = self.val_loss.item() / self.i_batch_val
+        val_acc_pct_0 = (self.val_acc0.item() / self.i_batch_val) * 100
         print(f" {self.i_epoch}. Val. Loss at t=0: {val_loss0:.2f}, Val. acc at t=0: {val_acc_pct_0:.1f}%, Val loss: {val_loss:.2f}")
-        self.val_loss = 0.0
-        self.val_loss0 = 0.0
-        self.val_acc0 = 0.0
+        self.val_loss.zero_()
+        self.val_loss0.zero_()
+        self.val_acc0.zero_()
         self.i_batch_val = 0
 
     def configure_optimizers(self):
@@ -161,9 +165,10 @@ class StandardClassifier(pl.LightningModule):
         self.loss_f = loss_f
 
         # Default Initialization
-        self.train_loss = 0.0
-        self.val_loss = 0.0
-        self.val_acc = 0.0
+        # Running sums are kept on device (non-persistent buffers follow the module), synced once per epoch
+        self.register_buffer("train_loss", th.zeros(()), persistent=False)
+        self.register_buffer("val_loss", th.zeros(()), persistent=False)
+        self.register_buffer("val_acc", th.zeros(()), persistent=False)
         self.i_batch_train = 0
         self.i_batch_val = 0
         self.i_epoch = 0
@@ -178,13 +183,13 @@ class StandardClassifier(pl.LightningModule):
         predicted_y = self.model(x)
         loss = self.loss_f(predicted_y, y)
         self.log("train_loss", loss)
-        self.train_loss += loss.detach().cpu().item()
+        self.train_loss += loss.detach()
         self.i_batch_train += 1
         return loss
 
     def on_train_epoch_end(self):
-        print(" {}. Train Loss: {}".format(self.i_epoch, self.train_loss / self.i_batch_train))
-        self.train_loss = 0.0
+        print(" {}. Train Loss: {}".format(self.i_epoch, self.train_loss.item() / self.i_batch_train))
+        self.train_loss.zero_()
         self.i_batch_train = 0
         self.i_epoch += 1
 
@@ -197,17 +202,17 @@ class StandardClassifier(pl.LightningModule):
 
         self.log("val_loss", loss)
         self.log("acc", acc)
-        self.val_loss += loss.detach().cpu().item()
-        self.val_acc += acc.detach().cpu().item()
+        self.val_loss += loss.detach()
+        self.val_acc += acc.detach()
         self.i_batch_val += 1
         return loss
 
     def on_validation_epoch_end(self):
-        print(
-            f" {self.i_epoch}. Val. Loss: {self.val_loss / self.i_batch_val}, Val. acc at t=0: {(self.val_acc / self.i_batch_val)*100:.1f}%"
-        )
-        self.val_loss = 0.0
-        self.val_acc = 0.0
+        val_loss = self.val_loss.item() / self.i_batch_val
+        val_acc_pct = (self.val_acc.item() / self.i_batch_val) * 100
+        print(f" {self.i_epoch}. Val. Loss: {val_loss}, Val. acc at t=0: {val_acc_pct:.1f}%")
+        self.val_loss.zero_()
+        self.val_acc.zero_()
         self.i_batch_val = 0
 
     def configure_optimizers(self):
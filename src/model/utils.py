@@ -1,3 +1,5 @@
+import torch as th
+
 # Diff models
 from src.model.cifar.utils import get_diff_model, select_cifar_classifier
 from src.model.guided_diff.unet import load_pretrained_diff_unet
@@ -88,3 +90,24 @@ def load_models(config, device, MODELS_DIR):
         post_var,
         energy_param,
     )
+
+
+def prepare_models(diff_model, classifier, dtype, channels_last: bool, compile_model: bool, energy_param: bool):
+    """Prepare loaded models for sampling: cast to dtype, optional channels_last (NHWC) layout and th.compile
+
+    channels_last is meant for the conv heavy 256x256 models.
+    float16 is not supported, the (unscaled) classifier guidance gradient underflows in it.
+    """
+    assert dtype in (th.float32, th.bfloat16), f"Unsupported dtype '{dtype}', use float32 or bfloat16"
+    if dtype != th.float32:
+        diff_model.to(dtype)
+        classifier.to(dtype)
+    if channels_last:
+        diff_model = diff_model.to(memory_format=th.channels_last)
+        classifier = classifier.to(memory_format=th.channels_last)
+    if compile_model:
+        # Energy models are kept eager, the sampler dispatches on isinstance(diff_model, EnergyModel).
+        if not energy_param:
+            diff_model = th.compile(diff_model, mode="reduce-overhead", fullgraph=False)
+        classifier = th.compile(classifier, mode="reduce-overhead", fullgraph=False)
+    return diff_model, classifier
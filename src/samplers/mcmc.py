@@ -1,6 +1,6 @@
 import pickle
 from pathlib import Path
-from typing import Callable, Dict, Optional
+from typing import Callable, Dict, Optional, Union
 import itertools
 from sympy.ntheory import factorint
 from abc import ABC, abstractmethod
@@ -9,12 +9,15 @@ import torch
 import torch as th
 import numpy as np
 
+# Step size per time step t, either a dict or a dense tensor indexed by t
+StepSizes = Union[Dict[int, float], th.Tensor]
+
 
 class MCMCSampler(ABC):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         gradient_function: Callable,
         energy_function: Optional[Callable] = None,
         grad_diff: Optional[Callable] = None,
@@ -60,7 +63,7 @@ class MCMCMHCorrSampler(MCMCSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         gradient_function: Callable,
         energy_function: Optional[Callable] = None,
     ):
@@ -80,15 +83,21 @@ class MCMCMHCorrSampler(MCMCSampler):
         self.all_accepts = dict()
         self.energy_diff = dict()
         self.alpha = dict()
+        # Keep stats on the device of x, avoids a host sync per MCMC step (set by the adaptive step size wrappers)
+        self.stats_on_device = False
 
     @abstractmethod
     def sample_step(self, *args, **kwargs):
         raise NotImplementedError
 
+    def _stat(self, x):
+        x = x.detach()
+        return x if self.stats_on_device else x.cpu()
+
     def save_stats(self, t, alpha, all_accepts, energy_diff):
-        self.alpha[t].append(alpha.detach().cpu())
-        self.all_accepts[t].append(all_accepts.detach().cpu())
-        self.energy_diff[t].append(energy_diff.detach().cpu())
+        self.alpha[t].append(self._stat(alpha))
+        self.all_accepts[t].append(self._stat(all_accepts))
+        self.energy_diff[t].append(self._stat(energy_diff))
 
     def update_save_dicts(self, t):
         self.alpha[t] = list()
@@ -113,7 +122,7 @@ class AnnealedULAEnergySampler(MCMCSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         gradient_function: Callable,
         energy_function: Optional[Callable] = None,
     ):
@@ -144,7 +153,7 @@ class AnnealedULAScoreSampler(MCMCSampler):
     Annealed Unadjusted-Langevin Algorithm
     """
 
-    def __init__(self, num_samples_per_step: int, step_sizes: Dict[int, float], gradient_function: Callable):
+    def __init__(self, num_samples_per_step: int, step_sizes: StepSizes, gradient_function: Callable):
         """
         @param num_samples_per_step: Number of ULA steps per timestep t
         @param step_sizes: Step sizes for each t
@@ -193,7 +202,7 @@ class AnnealedLAScoreSampler(MCMCMHCorrSampler):
             mean_x_hat, grad_1 = get_mean_grad(self.gradient_function, x_hat, t, t_idx, ss, classes)
             logp_reverse, logp_forward = transition_factor(x, mean_x, x_hat, mean_x_hat, ss, dims)
 
-            intermediate_steps = th.linspace(0, 1, steps=self.n_trapets).to(x.device)
+            intermediate_steps = th.linspace(0, 1, steps=self.n_trapets, device=x.device)
 
             grads = [None for _ in range(self.n_trapets)]
             grads[0] = grad_0
@@ -209,7 +218,7 @@ class AnnealedLAScoreSampler(MCMCMHCorrSampler):
 
             logp_accept = energy_diff + logp_reverse - logp_forward
 
-            u = th.rand(x.shape[0]).to(x.device)
+            u = th.rand(x.shape[0], device=x.device)
             alpha = th.exp(logp_accept)
             accept = (u < alpha).to(th.float32).reshape((x.shape[0],) + tuple(([1 for _ in range(dims - 1)])))
             x = accept * x_hat + (1 - accept) * x
@@ -253,7 +262,7 @@ class AnnealedLAEnergySampler(MCMCMHCorrSampler):
                            - self.energy_function(x, t, t_idx, classes).detach())
             logp_accept = energy_diff + logp_reverse - logp_forward
 
-            u = th.rand(x.shape[0]).to(x.device)
+            u = th.rand(x.shape[0], device=x.device)
             alpha = th.exp(logp_accept)
             accept = (
                 (u < alpha).to(th.float32).reshape((x.shape[0],) + tuple(([1 for _ in range(dims - 1)])))
@@ -359,7 +368,7 @@ class AnnealedUHMCScoreSampler(MCMCSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         damping_coeff: float,
         mass_diag_sqrt: th.Tensor,
         num_leapfrog_steps: int,
@@ -409,7 +418,7 @@ class AnnealedUHMCEnergySampler(MCMCSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         damping_coeff: float,
         mass_diag_sqrt: th.Tensor,
         num_leapfrog_steps: int,
@@ -467,7 +476,7 @@ class AnnealedHMCScoreSampler(MCMCMHCorrSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         damping_coeff: float,
         mass_diag_sqrt: th.Tensor,
         num_leapfrog_steps: int,
@@ -528,7 +537,7 @@ class AnnealedHMCScoreSampler(MCMCMHCorrSampler):
             energy_diff = classifier_energy_diff + estimate_energy_diff_intermediate(diffs, grads, dims).to(x_next.device)
             logp_accept = logp_v - logp_v_p + energy_diff
 
-            u = th.rand(x_next.shape[0]).to(x_next.device)
+            u = th.rand(x_next.shape[0], device=x_next.device)
             alpha = th.exp(logp_accept)
             accept = (u < alpha).to(th.float32).reshape((x_next.shape[0],) + tuple(([1 for _ in range(dims - 1)])))
 
@@ -545,7 +554,7 @@ class AnnealedHMCEnergySampler(MCMCMHCorrSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         damping_coeff: float,
         mass_diag_sqrt: th.Tensor,
         num_leapfrog_steps: int,
@@ -603,7 +612,7 @@ class AnnealedHMCEnergySampler(MCMCMHCorrSampler):
                            - self.energy_function(x, t, t_idx, classes).detach())
             logp_accept = logp_v - logp_v_p + energy_diff
 
-            u = th.rand(x_next.shape[0]).to(x_next.device)
+            u = th.rand(x_next.shape[0], device=x_next.device)
             alpha = th.exp(logp_accept)
             accept = (
                 (u < alpha)
@@ -677,6 +686,29 @@ def estimate_energy_diff(xs_, grads_, dims):
     return energy
 
 
+def update_step_size(step_s, a_rate, accept_lower, accept_upper, upper, lower, seed):
+    """New step size from the accept rate of the current one
+
+    Records step_s as the best step size so far above/below the accept rate bounds (in place in upper/lower),
+    then interpolates (log scale, random weight) between those bounds once both are known,
+    otherwise scales the step size by a factor 10.
+    """
+    if accept_upper < a_rate <= upper["accept"]:
+        upper["accept"] = a_rate
+        upper["stepsize"] = step_s
+    if lower["accept"] <= a_rate < accept_lower:
+        lower["accept"] = a_rate
+        lower["stepsize"] = step_s
+
+    if upper["stepsize"] is not None and lower["stepsize"] is not None:
+        torch.manual_seed(seed)
+        w = th.rand(1).item()
+        return torch.exp(w * torch.log(upper["stepsize"]) + (1 - w) * torch.log(lower["stepsize"]))
+    if a_rate > accept_upper:
+        return step_s * 10
+    return step_s / 10
+
+
 class AdaptiveStepSizeConstantMCMCSamplerWrapper(MCMCMHCorrSampler):
     def __init__(self, sampler: MCMCMHCorrSampler, accept_rate_bound: list, time_steps, max_iter: int = 10):
         super().__init__(
@@ -686,6 +718,7 @@ class AdaptiveStepSizeConstantMCMCSamplerWrapper(MCMCMHCorrSampler):
             energy_function=sampler.energy_function,
         )
         self.sampler = sampler
+        self.sampler.stats_on_device = True
         self.accept_rate_bound = accept_rate_bound
         self.max_iter = max_iter
         self.respaced_T = time_steps.size(0)
@@ -711,34 +744,18 @@ class AdaptiveStepSizeConstantMCMCSamplerWrapper(MCMCMHCorrSampler):
             th.set_rng_state(current_rng_state)
             x_ = x_.detach()
             # a_rate = np.mean(self.sampler.accept_ratio[t])
-            a_rate = np.mean([th.clip(alpha, 0., 1.).mean().item() for alpha in self.sampler.alpha[t]])
+            # Single host sync per step size candidate
+            a_rate = th.stack(self.sampler.alpha[t]).clip(0., 1.).mean().item()
             step_s = self.sampler.step_sizes[t].clone()
             self.res[t]["accepts"].append(a_rate)
             self.res[t]["step_sizes"].append(step_s.detach().cpu().item())
             if self.accept_rate_bound[0] <= a_rate <= self.accept_rate_bound[1]:
                 step_found = True
             else:
-                # Update best bound so far
-                if self.accept_rate_bound[1] < a_rate <= upper["accept"]:
-                    upper["accept"] = a_rate
-                    upper["stepsize"] = step_s
-                if lower["accept"] <= a_rate < self.accept_rate_bound[0]:
-                    lower["accept"] = a_rate
-                    lower["stepsize"] = step_s
-
-                # New step size
-                step_s_ = step_s.clone()
-                if upper["stepsize"] is not None and lower["stepsize"] is not None:
-                    torch.manual_seed(t * 1000 + i)
-                    w = th.rand(1).item()
-                    new_step_s = torch.exp(w * torch.log(upper["stepsize"]) + (1 - w) * torch.log(lower["stepsize"]))
-                else:
-                    if a_rate > self.accept_rate_bound[1]:
-                        new_step_s = step_s_ * 10
-                    else:  # a_rate < self.accept_rate_bound[0]
-                        new_step_s = step_s_ / 10
-
-                self.sampler.step_sizes[t] = new_step_s
+                self.sampler.step_sizes[t] = update_step_size(
+                    step_s, a_rate, self.accept_rate_bound[0], self.accept_rate_bound[1], upper, lower,
+                    seed=t * 1000 + i,
+                )
             i += 1
         torch.set_rng_state(state)
         return x_
@@ -773,6 +790,7 @@ class AdaptiveStepSizeConstantMCMCSamplerWrapperSmallBatchSize(MCMCMHCorrSampler
             energy_function=sampler.energy_function,
         )
         self.sampler = sampler
+        self.sampler.stats_on_device = True
         self.accept_rate_bound = accept_rate_bound
         self.max_iter = max_iter
         self.respaced_T = time_steps.size(0)
@@ -805,40 +823,23 @@ class AdaptiveStepSizeConstantMCMCSamplerWrapperSmallBatchSize(MCMCMHCorrSampler
                 x_ = self.sampler.sample_step(x_, t, t_idx, y_)
                 x_next[idx[j] : idx[j + 1]] = x_.detach().cpu()
                 # accepts += list(itertools.chain(*[acc.numpy().tolist() for acc in self.sampler.all_accepts[t]]))
-                accepts += [np.mean([th.clip(alpha, 0., 1.).mean().item() for alpha in self.sampler.alpha[t]])]
+                accepts.append(th.stack(self.sampler.alpha[t]).clip(0., 1.).mean())
                 del x_
                 del y_
                 gc.collect()
                 torch.cuda.empty_cache()
-            a_rate = np.mean(accepts)
+            # Single host sync per step size candidate
+            a_rate = th.stack(accepts).mean().item()
             step_s = self.sampler.step_sizes[t].clone()
             self.res[t]["accepts"].append(a_rate)
             self.res[t]["step_sizes"].append(step_s.detach().cpu().item())
             if self.accept_rate_bound[0] <= a_rate <= self.accept_rate_bound[1]:
                 step_found = True
             else:
-                # Update best bound so far
-                if self.accept_rate_bound[1] < a_rate <= upper["accept"]:
-                    upper["accept"] = a_rate
-                    upper["stepsize"] = step_s
-                if lower["accept"] <= a_rate < self.accept_rate_bound[0]:
-                    lower["accept"] = a_rate
-                    lower["stepsize"] = step_s
-
-                    # New step size
-                    step_s_ = step_s.clone()
-                    if upper["stepsize"] is not None and lower["stepsize"] is not None:
-                        torch.manual_seed(t * 1000 + i)
-                        w = th.rand(1).item()
-                        new_step_s = torch.exp(
-                            w * torch.log(upper["stepsize"]) + (1 - w) * torch.log(lower["stepsize"]))
-                    else:
-                        if a_rate > self.accept_rate_bound[1]:
-                            new_step_s = step_s_ * 10
-                        else:  # a_rate < self.accept_rate_bound[0]
-                            new_step_s = step_s_ / 10
-
-                    self.sampler.step_sizes[t] = new_step_s
+                self.sampler.step_sizes[t] = update_step_size(
+                    step_s, a_rate, self.accept_rate_bound[0], self.accept_rate_bound[1], upper, lower,
+                    seed=t * 1000 + i,
+                )
             i += 1
         torch.set_rng_state(state)
         return x_next
@@ -865,6 +866,7 @@ class AdaptiveStepSizeReferenceMCMCSamplerWrapper(MCMCMHCorrSampler):
             energy_function=sampler.energy_function,
         )
         self.sampler = sampler
+        self.sampler.stats_on_device = True
         self.accept_rate_reference = accept_rate_reference
         self.max_iter = max_iter
         self.respaced_T = time_steps.size(0)
@@ -890,35 +892,19 @@ class AdaptiveStepSizeReferenceMCMCSamplerWrapper(MCMCMHCorrSampler):
             x_ = self.sampler.sample_step(x, t, t_idx, classes)
             th.set_rng_state(current_rng_state)
             x_ = x_.detach()
-            a_rate = np.mean([th.clip(alpha, 0., 1.).mean().item() for alpha in self.sampler.alpha[t]])
+            # Single host sync per step size candidate
+            a_rate = th.stack(self.sampler.alpha[t]).clip(0., 1.).mean().item()
             step_s = self.sampler.step_sizes[t].clone()
             self.res[t]["accepts"].append(a_rate)
             self.res[t]["step_sizes"].append(step_s.detach().cpu().item())
             if self.accept_rate_reference[t] - self.marginal <= a_rate <= self.accept_rate_reference[t] + self.marginal:
                 step_found = True
             else:
-                # Update best bound so far
-                if self.accept_rate_reference[t] + self.marginal < a_rate <= upper["accept"]:
-                    upper["accept"] = a_rate
-                    upper["stepsize"] = step_s
-
-                if lower["accept"] <= a_rate < self.accept_rate_reference[t] - self.marginal:
-                    lower["accept"] = a_rate
-                    lower["stepsize"] = step_s
-
-                # New step size
-                step_s_ = step_s.clone()
-                if upper["stepsize"] is not None and lower["stepsize"] is not None:
-                    torch.manual_seed(t * 1000 + i)
-                    w = th.rand(1).item()
-                    new_step_s = torch.exp(w * torch.log(upper["stepsize"]) + (1 - w) * torch.log(lower["stepsize"]))
-                else:
-                    if a_rate > self.accept_rate_reference[t] + self.marginal:
-                        new_step_s = step_s_ * 10
-                    else:  # a_rate < self.accept_rate_bound[0]
-                        new_step_s = step_s_ / 10
-
-                self.sampler.step_sizes[t] = new_step_s
+                accept_rate_ref = self.accept_rate_reference[t]
+                self.sampler.step_sizes[t] = update_step_size(
+                    step_s, a_rate, accept_rate_ref - self.marginal, accept_rate_ref + self.marginal, upper, lower,
+                    seed=t * 1000 + i,
+                )
             i += 1
         torch.set_rng_state(state)
         return x_
@@ -954,6 +940,7 @@ class AdaptiveStepSizeReferenceMCMCSamplerWrapperSmallBatchSize(MCMCMHCorrSample
             energy_function=sampler.energy_function,
         )
         self.sampler = sampler
+        self.sampler.stats_on_device = True
         self.accept_rate_reference = accept_rate_reference
         self.marginal = marginal
         self.max_iter = max_iter
@@ -986,40 +973,24 @@ class AdaptiveStepSizeReferenceMCMCSamplerWrapperSmallBatchSize(MCMCMHCorrSample
                 y_ = text_embeddings[idx[j] : idx[j + 1]].to(self.device)
                 x_ = self.sampler.sample_step(x_, t, t_idx, y_)
                 x_next[idx[j] : idx[j + 1]] = x_.detach().cpu()
-                accepts += [np.mean([th.clip(alpha, 0., 1.).mean().item() for alpha in self.sampler.alpha[t]])]
+                accepts.append(th.stack(self.sampler.alpha[t]).clip(0., 1.).mean())
                 del x_
                 del y_
                 gc.collect()
                 torch.cuda.empty_cache()
-            a_rate = np.mean(accepts)
+            # Single host sync per step size candidate
+            a_rate = th.stack(accepts).mean().item()
             step_s = self.sampler.step_sizes[t].clone()
             self.res[t]["accepts"].append(a_rate)
             self.res[t]["step_sizes"].append(step_s.detach().cpu().item())
             if self.accept_rate_reference[t] - self.marginal <= a_rate <= self.accept_rate_reference[t] + self.marginal:
                 step_found = True
             else:
-                # Update best bound so far
-                if self.accept_rate_reference[t] + self.marginal < a_rate <= upper["accept"]:
-                    upper["accept"] = a_rate
-                    upper["stepsize"] = step_s
-
-                if lower["accept"] <= a_rate < self.accept_rate_reference[t] - self.marginal:
-                    lower["accept"] = a_rate
-                    lower["stepsize"] = step_s
-
-                # New step size
-                step_s_ = step_s.clone()
-                if upper["stepsize"] is not None and lower["stepsize"] is not None:
-                    torch.manual_seed(t * 1000 + i)
-                    w = th.rand(1).item()
-                    new_step_s = torch.exp(w * torch.log(upper["stepsize"]) + (1 - w) * torch.log(lower["stepsize"]))
-                else:
-                    if a_rate > self.accept_rate_reference[t] + self.marginal:
-                        new_step_s = step_s_ * 10
-                    else:  # a_rate < self.accept_rate_bound[0]
-                        new_step_s = step_s_ / 10
-
-                self.sampler.step_sizes[t] = new_step_s
+                accept_rate_ref = self.accept_rate_reference[t]
+                self.sampler.step_sizes[t] = update_step_size(
+                    step_s, a_rate, accept_rate_ref - self.marginal, accept_rate_ref + self.marginal, upper, lower,
+                    seed=t * 1000 + i,
+                )
             i += 1
         torch.set_rng_state(state)
         return x_next
@@ -1043,7 +1014,7 @@ class AnnealedHMCEnergyApproxSampler(MCMCMHCorrSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         damping_coeff: float,
         mass_diag_sqrt: th.Tensor,
         num_leapfrog_steps: int,
@@ -1122,7 +1093,7 @@ class AnnealedHMCEnergyApproxSampler(MCMCMHCorrSampler):
 
             """
             n_trapets = 5
-            intermediate_steps = th.linspace(0, 1, steps=n_trapets).to(x.device)
+            intermediate_steps = th.linspace(0, 1, steps=n_trapets, device=x.device)
             grads = [None for _ in range(n_trapets)]
             energy_diff_approx2 = estimate_energy_diff_linear_given_intermediate(
                 self.gradient_function, grads, x, x_next, t, t_idx, intermediate_steps, classes, dims
@@ -1135,7 +1106,7 @@ class AnnealedHMCEnergyApproxSampler(MCMCMHCorrSampler):
             alpha_approx = th.exp(logp_accept_approx)
             # print(th.mean(th.abs(th.clip(alpha, 0, 1) - th.clip(alpha_approx, 0, 1))).item())
 
-            u = th.rand(x_next.shape[0]).to(x_next.device)
+            u = th.rand(x_next.shape[0], device=x_next.device)
 
             if alpha is None:
                 alpha_use = alpha_approx
@@ -1257,7 +1228,7 @@ class AnnealedHMCScoreNumberTrapsSampler(MCMCMHCorrSampler):
     def __init__(
         self,
         num_samples_per_step: int,
-        step_sizes: Dict[int, float],
+        step_sizes: StepSizes,
         damping_coeff: float,
         mass_diag_sqrt: th.Tensor,
         num_leapfrog_steps: int,
@@ -1319,7 +1290,7 @@ class AnnealedHMCScoreNumberTrapsSampler(MCMCMHCorrSampler):
             energy_diff = classifier_energy_diff + estimate_energy_diff_intermediate(diffs, grads, dims).to(x_next.device)
             logp_accept = logp_v - logp_v_p + energy_diff
 
-            u = th.rand(x_next.shape[0]).to(x_next.device)
+            u = th.rand(x_next.shape[0], device=x_next.device)
             alpha = th.exp(logp_accept)
             accept = (u < alpha).to(th.float32).reshape((x_next.shape[0],) + tuple(([1 for _ in range(dims - 1)])))
 
@@ -1335,15 +1306,15 @@ class AnnealedHMCScoreNumberTrapsSampler(MCMCMHCorrSampler):
                         x_next.device)
                     logp_accept = logp_v - logp_v_p + energy_diff
                     alpha_ = th.exp(logp_accept)
-                    factor_alpha[factor - 1] = alpha_.detach().cpu()
+                    factor_alpha[factor - 1] = self._stat(alpha_)
             self.save_stats(t, alpha, factor_alpha, accept, energy_diff)
         return x
 
 
     def save_stats(self, t, alpha, factor_alpha, all_accepts, energy_diff):
-        self.alpha[t].append(alpha.detach().cpu())
-        self.all_accepts[t].append(all_accepts.detach().cpu())
-        self.energy_diff[t].append(energy_diff.detach().cpu())
+        self.alpha[t].append(self._stat(alpha))
+        self.all_accepts[t].append(self._stat(all_accepts))
+        self.energy_diff[t].append(self._stat(energy_diff))
         self.factor_alpha[t].append(factor_alpha)
 
     def update_save_dicts(self, t):
@@ -21,10 +21,11 @@ from exp.utils import get_step_size
 
 
 def get_guid_sampler(config, diff_model, diff_sampler, guidance, time_steps, dataset_name, energy_param: bool,
-                     MODELS_DIR, save_grad=False):
+                     MODELS_DIR, save_grad=False, channels_last=False):
     if config.mcmc_method is None:
         guid_sampler = GuidanceSampler(diff_model, diff_sampler, guidance, diff_cond=config.class_cond,
-                                       save_grad=save_grad)
+                                       save_grad=save_grad, fuse_guidance=config.fuse_guidance,
+                                       channels_last=channels_last)
     else:
         assert config.mcmc_steps is not None
         assert config.mcmc_method is not None
@@ -33,7 +34,7 @@ def get_guid_sampler(config, diff_model, diff_sampler, guidance, time_steps, dat
             print("Load step sizes for MCMC.")
             step_sizes = get_step_size(
                 MODELS_DIR / "step_sizes", dataset_name, config.mcmc_method, config.mcmc_stepsizes["bounds"],
-                str(config.num_diff_steps)
+                str(config.num_diff_steps), time_steps=time_steps
             )
         else:
             print("Use parameterized step sizes for MCMC.")
@@ -101,5 +102,7 @@ def get_guid_sampler(config, diff_model, diff_sampler, guidance, time_steps, dat
             reverse=True,
             diff_cond=config.class_cond,
             save_grad=save_grad,
+            fuse_guidance=config.fuse_guidance,
+            channels_last=channels_last,
         )
     return guid_sampler
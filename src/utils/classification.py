@@ -22,13 +22,31 @@ def accuracy(y_true: th.Tensor, y_pred: th.Tensor) -> float:
 def entropy(prob_vec: th.Tensor) -> float:
     """Compute entropy of a probability vector
 
+    Prefer entropy_from_logits when logits are available, it avoids the extra softmax.
+
     Args:
         prob_vec: (batch_size, num_classes)
 
     Returns:
         average entropy
     """
-    entropy = -th.sum(prob_vec * th.log(prob_vec), dim=1)
+    # xlogy: 0 * log(0) = 0, rather than nan
+    entropy = -th.special.xlogy(prob_vec, prob_vec).sum(dim=1)
+    return entropy.mean().item()
+
+
+@th.no_grad()
+def entropy_from_logits(logits: th.Tensor) -> float:
+    """Compute entropy of the class distribution given by logits
+
+    Args:
+        logits: (batch_size, num_classes) in R^n
+
+    Returns:
+        average entropy
+    """
+    log_p = F.log_softmax(logits, dim=1)
+    entropy = -(log_p.exp() * log_p).sum(dim=1)
     return entropy.mean().item()
 
 
@@ -8,6 +8,7 @@ from pathlib import Path
 from collections import OrderedDict
 from enum import Enum
 from typing import Optional
+import gc
 import math
 
 import torch as th
@@ -245,3 +246,23 @@ def get_device(target: Optional[Enum] = None):
             return th.device("cpu")
     else:
         return th.device("cpu")
+
+
+def set_cuda_backend_flags():
+    """
+    Backend flags for repeated, fixed shape inference (sampling):
+    TF32 tensor cores for fp32 matmuls and convolutions, and autotuned conv algorithms (cudnn.benchmark).
+    """
+    th.backends.cuda.matmul.allow_tf32 = True
+    th.backends.cudnn.allow_tf32 = True
+    th.backends.cudnn.benchmark = True
+
+
+def free_cuda_memory():
+    """
+    Release the GPU memory of a failed (out of memory) attempt before retrying.
+
+    Call outside the except block, inside it the traceback still holds on to the tensors of the failed attempt.
+    """
+    gc.collect()
+    th.cuda.empty_cache()
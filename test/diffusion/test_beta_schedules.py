@@ -1,7 +1,13 @@
 """Test diffusion parameter arithmetics"""
 import unittest
 import torch as th
-from src.diffusion.beta_schedules import linear_beta_schedule, improved_beta_schedule, respaced_beta_schedule
+from src.diffusion.base import compute_alpha_bars
+from src.diffusion.beta_schedules import (
+    linear_beta_schedule,
+    improved_beta_schedule,
+    respaced_beta_schedule,
+    respaced_timesteps,
+)
 
 
 class BetaShedules(unittest.TestCase):
@@ -19,6 +25,11 @@ class BetaShedules(unittest.TestCase):
         betas = th.tensor([0.1012940794, 0.2795438460, 0.4736353534, 0.7240523691, 0.9990000000])
         self.assertTrue(th.all(th.isclose(improved_beta_schedule(5), betas)))
 
+    def test_cached_schedule_is_copy(self):
+        betas = linear_beta_schedule(num_timesteps=10)
+        betas[0] = -1.0
+        self.assertTrue(th.all(linear_beta_schedule(num_timesteps=10) > 0.0))
+
 
 class RespacedBetaSchedules(unittest.TestCase):
     def test_sparse_factor_one_equal(self):
@@ -30,3 +41,14 @@ class RespacedBetaSchedules(unittest.TestCase):
 
             self.assertTrue(th.all(time_steps == th.arange(0, T)))
             self.assertTrue(th.allclose(betas, respaced_betas, atol=1e-2))
+
+    def test_respaced_alpha_bars_match(self):
+        T = 1000
+        respaced_T = 250
+        betas = linear_beta_schedule(num_timesteps=T)
+        respaced_betas, time_steps = respaced_beta_schedule(original_betas=betas, T=T, respaced_T=respaced_T)
+
+        self.assertTrue(th.all(time_steps == respaced_timesteps(T, respaced_T)))
+        self.assertEqual(respaced_betas.size(0), respaced_T)
+        alpha_bars = compute_alpha_bars(1 - betas)[time_steps]
+        self.assertTrue(th.allclose(compute_alpha_bars(1 - respaced_betas), alpha_bars, atol=1e-5))
@@ -0,0 +1,70 @@
+"""Test loading of MCMC step sizes"""
+import os
+import pickle
+import unittest
+import tempfile
+from pathlib import Path
+import torch as th
+from exp.utils import get_step_size, dense_step_sizes, dense_step_size_path
+
+
+def step_size_search_result():
+    """Search result over the time steps 0, 4, 8, 'best' has no entry for the last one"""
+    res = {t: {"accepts": [0.6], "step_sizes": [0.1 * (t + 1)]} for t in (8, 0, 4)}
+    res["best"] = {"accept": [0.6, 0.6], "step_sizes": [0.1, 0.5]}
+    return res
+
+
+class StepSize(unittest.TestCase):
+    name = ("hmc", "cifar10", "1000", "55_65")
+
+    def _result_path(self, step_size_dir: Path) -> Path:
+        mcmc_method, dataset_name, num_steps, bounds = self.name
+        return step_size_dir / f"{mcmc_method}_{dataset_name}_{num_steps}_{bounds}.pt"
+
+    def _get_step_size(self, step_size_dir: Path, time_steps=None):
+        mcmc_method, dataset_name, num_steps, bounds = self.name
+        return get_step_size(step_size_dir, dataset_name, mcmc_method, bounds, num_steps, time_steps=time_steps)
+
+    def test_dense_step_sizes(self):
+        step_size = dense_step_sizes(step_size_search_result())
+        self.assertEqual(step_size.size(0), 5)
+        self.assertTrue(th.allclose(step_size[[0, 4]], th.tensor([0.1, 0.5])))
+        self.assertTrue(th.all(th.isnan(step_size[1:4])))
+
+    def test_newer_dense_file_used(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = self._result_path(Path(tmp_dir))
+            th.save(step_size_search_result(), path)
+            dense = th.tensor([1.0, 2.0])
+            th.save(dense, dense_step_size_path(path))
+            os.utime(path, (0, 0))
+            self.assertTrue(th.equal(self._get_step_size(Path(tmp_dir)), dense))
+
+    def test_stale_dense_file_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = self._result_path(Path(tmp_dir))
+            th.save(step_size_search_result(), path)
+            th.save(th.tensor([1.0, 2.0]), dense_step_size_path(path))
+            os.utime(dense_step_size_path(path), (0, 0))
+            step_size = self._get_step_size(Path(tmp_dir))
+            self.assertTrue(th.allclose(step_size[[0, 4]], th.tensor([0.1, 0.5])))
+
+    def test_legacy_pickle_fallback(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = self._result_path(Path(tmp_dir))
+            with open(path.with_suffix(".p"), "wb") as f:
+                pickle.dump(step_size_search_result(), f)
+            step_size = self._get_step_size(Path(tmp_dir))
+            self.assertTrue(th.allclose(step_size[[0, 4]], th.tensor([0.1, 0.5])))
+
+    def test_time_steps_coverage(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            th.save(step_size_search_result(), self._result_path(Path(tmp_dir)))
+            # MCMC is run at time_steps[:-1]
+            step_size = self._get_step_size(Path(tmp_dir), time_steps=th.tensor([0, 4, 8]))
+            self.assertTrue(th.allclose(step_size[[0, 4]], th.tensor([0.1, 0.5])))
+            with self.assertRaises(AssertionError):
+                self._get_step_size(Path(tmp_dir), time_steps=th.tensor([0, 2, 4, 8]))
+            with self.assertRaises(AssertionError):
+                self._get_step_size(Path(tmp_dir), time_steps=th.tensor([0, 4, 8, 12]))
@@ -0,0 +1,48 @@
+"""Test guided diffusion UNet attention
+
+Compare the scaled_dot_product_attention based QKV attention with the einsum reference implementation.
+"""
+import math
+import unittest
+import torch as th
+from src.model.guided_diff.unet import QKVAttention, QKVAttentionLegacy
+
+
+def _attention_ref(q, k, v):
+    """Einsum reference, q, k, v: [N x C x T]"""
+    ch = q.size(1)
+    scale = 1 / math.sqrt(math.sqrt(ch))
+    weight = th.einsum("bct,bcs->bts", q * scale, k * scale)
+    weight = th.softmax(weight.float(), dim=-1).type(weight.dtype)
+    return th.einsum("bts,bcs->bct", weight, v)
+
+
+def qkv_attention_legacy_ref(qkv, n_heads):
+    bs, width, length = qkv.shape
+    ch = width // (3 * n_heads)
+    q, k, v = qkv.reshape(bs * n_heads, ch * 3, length).split(ch, dim=1)
+    return _attention_ref(q, k, v).reshape(bs, -1, length)
+
+
+def qkv_attention_ref(qkv, n_heads):
+    bs, width, length = qkv.shape
+    ch = width // (3 * n_heads)
+    q, k, v = map(lambda t: t.reshape(bs * n_heads, ch, length), qkv.chunk(3, dim=1))
+    return _attention_ref(q, k, v).reshape(bs, -1, length)
+
+
+class QKVAttentionNumerics(unittest.TestCase):
+    # length != ch, so a mix up of the head/channel and token dims fails
+    bs, n_heads, ch, length = 2, 4, 8, 12
+
+    def test_qkv_attention_legacy(self):
+        qkv = th.randn((self.bs, 3 * self.n_heads * self.ch, self.length))
+        out = QKVAttentionLegacy(self.n_heads)(qkv)
+        self.assertEqual(out.size(), (self.bs, self.n_heads * self.ch, self.length))
+        self.assertTrue(th.allclose(out, qkv_attention_legacy_ref(qkv, self.n_heads), atol=1e-5))
+
+    def test_qkv_attention(self):
+        qkv = th.randn((self.bs, 3 * self.n_heads * self.ch, self.length))
+        out = QKVAttention(self.n_heads)(qkv)
+        self.assertEqual(out.size(), (self.bs, self.n_heads * self.ch, self.length))
+        self.assertTrue(th.allclose(out, qkv_attention_ref(qkv, self.n_heads), atol=1e-5))
@@ -0,0 +1,30 @@
+"""Test MCMC sampler helpers"""
+import unittest
+import torch as th
+from src.samplers.mcmc import update_step_size
+
+
+class UpdateStepSize(unittest.TestCase):
+    def test_scale_without_both_bounds(self):
+        upper = {"stepsize": None, "accept": 1}
+        lower = {"stepsize": None, "accept": 0}
+        # Accept rate too high: increase step size
+        step_s = update_step_size(th.tensor(1.0), 0.95, 0.5, 0.7, upper, lower, seed=0)
+        self.assertAlmostEqual(step_s.item(), 10.0, places=5)
+        self.assertEqual(upper["accept"], 0.95)
+        self.assertIsNone(lower["stepsize"])
+
+        upper = {"stepsize": None, "accept": 1}
+        lower = {"stepsize": None, "accept": 0}
+        # Accept rate too low: decrease step size
+        step_s = update_step_size(th.tensor(1.0), 0.1, 0.5, 0.7, upper, lower, seed=0)
+        self.assertAlmostEqual(step_s.item(), 0.1, places=5)
+        self.assertEqual(lower["accept"], 0.1)
+        self.assertIsNone(upper["stepsize"])
+
+    def test_interpolate_between_bounds(self):
+        upper = {"stepsize": th.tensor(0.1), "accept": 0.9}
+        lower = {"stepsize": None, "accept": 0}
+        step_s = update_step_size(th.tensor(1.0), 0.2, 0.5, 0.7, upper, lower, seed=0)
+        self.assertEqual(lower["accept"], 0.2)
+        self.assertTrue(0.1 <= step_s.item() <= 1.0)
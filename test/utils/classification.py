@@ -1,7 +1,7 @@
 """Test classification helpers"""
 import unittest
 import torch as th
-from src.utils.classification import logits_to_log_prob, logits_to_log_prob_mean
+from src.utils.classification import logits_to_log_prob, logits_to_log_prob_mean, entropy, entropy_from_logits
 
 
 class Classification(unittest.TestCase):
@@ -23,3 +23,14 @@ class Classification(unittest.TestCase):
         self.assertFalse(th.any(th.exp(p) > 1.0))
         self.assertFalse(th.any(th.exp(p) < 0.0))
         self.assertTrue(th.allclose(th.exp(p).sum(dim=1), th.ones((100,))))
+
+    def test_entropy_from_logits(self):
+        logits = th.randn((100, 10))
+        prob_vec = th.softmax(logits, dim=1)
+        self.assertAlmostEqual(entropy_from_logits(logits), entropy(prob_vec), places=5)
+
+    def test_entropy_zero_prob(self):
+        prob_vec = th.tensor([[1.0, 0.0], [0.5, 0.5]])
+        self.assertAlmostEqual(entropy(prob_vec), 0.5 * th.log(th.tensor(2.0)).item(), places=6)
+        logits = th.tensor([[0.0, -1e4], [0.0, 0.0]])
+        self.assertAlmostEqual(entropy_from_logits(logits), 0.5 * th.log(th.tensor(2.0)).item(), places=6)